@@ -3,22 +3,103 @@ This file compiles the code in Web Browser Engineering,
 up to and including Chapter 1 (Downloading Web Pages),
 without exercises.
 """
+import concurrent.futures  # For making several requests at once
+import heapq  # For finding the cached pages that expire first
+import re  # For parsing Cache-Control and Content-Type headers
+import sys  # For writing the page to standard output
+import threading  # For sharing the cache between request_many's threads
 import time  # For caching the expiration time of cached pages
 import socket  # For connecting to the web
 import ssl  # For HTTPS
 
 # A cache of downloaded pages
-# The key is the URL, and the value is a tuple of the headers and body and the
-# time it expired
+# The key is the URL, and the value is a tuple of the headers, the body (as the
+# raw bytes the server sent, which decode_body turns into text), and the time
+# it expires
 # So for example,
 # {
-#     "http://example.org": ({...}, "Hello, world!", 1234567890),
-#     "http://example.org/about": ({...}, "About us", 1234567890),
+#     "http://example.org": ({...}, b"Hello, world!", 1234567890),
+#     "http://example.org/about": ({...}, b"About us", 1234567890),
 # }
 CACHE = {}
 
+# A min-heap of (expiration time, URL) pairs for the pages in the cache, so that
+# we can find and remove expired pages, even ones that are never requested
+# again, without checking every page in the cache
+EXPIRATIONS = []
+
+# request_many fetches pages on several threads at once, and they all share the
+# cache, so they take turns with it: hold this lock while using CACHE or
+# EXPIRATIONS
+CACHE_LOCK = threading.Lock()
+
 BOOKMARKS = []
 
+# Open connections that servers have agreed to keep alive, so that a later
+# request to the same server can skip connecting (and the TLS handshake) again.
+# The key is the (scheme, host, port) the connection is to, and the value is a
+# list of (socket, response file) pairs that are ready for another request.
+CONNECTIONS = {}
+
+# The SSL context used to encrypt every HTTPS connection, created the first
+# time we make one (see connect)
+SSL_CONTEXT = None
+
+# The most redirects request will follow in a row before giving up
+MAX_REDIRECTS = 10
+
+# The most requests request_many will make at the same time
+MAX_CONCURRENT_REQUESTS = 16
+
+# Match the no-store and max-age directives of a Cache-Control header, which
+# is a comma-separated list like "public, max-age=3600". A directive has to
+# start the header or follow a comma, so that one whose name merely ends in
+# max-age doesn't count, and max-age captures its value in seconds.
+NO_STORE_PATTERN = re.compile(r"(?:^|,)\s*no-store\b", re.IGNORECASE)
+MAX_AGE_PATTERN = re.compile(r"(?:^|,)\s*max-age\s*=\s*(\d+)", re.IGNORECASE)
+
+# Match the charset parameter of a Content-Type header, like the utf-8 in
+# "text/html; charset=utf-8", which tells us how the body is encoded
+CHARSET_PATTERN = re.compile(r";\s*charset\s*=\s*\"?([\w.:-]+)", re.IGNORECASE)
+
+
+# The header names we send or look for ourselves, interned. Lowercasing a
+# header name makes a brand new string on every response; swapping it for the
+# interned copy here lets that string be freed right away, and lets later
+# lookups of the same name match by identity instead of comparing characters.
+KNOWN_HEADERS = {
+    name: sys.intern(name)
+    for name in (
+        "host",
+        "connection",
+        "user-agent",
+        "content-length",
+        "content-type",
+        "content-encoding",
+        "transfer-encoding",
+        "location",
+        "cache-control",
+    )
+}
+
+
+# A dictionary whose keys are case-insensitive, like HTTP header names. Keys are
+# lowercased once, as they're stored or looked up, so that callers never need
+# to lowercase them themselves.
+class CaseInsensitiveDict(dict):
+    def __setitem__(self, key, value):
+        key = key.lower()
+        super().__setitem__(KNOWN_HEADERS.get(key, key), value)
+
+    def __getitem__(self, key):
+        return super().__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super().__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
 
 # Caching: Typically the same images, styles, and scripts are used on multiple
 # pages; downloading them repeatedly is a waste. It’s generally valid to cache
@@ -34,43 +115,237 @@ def cache(url, headers, body):
     if "cache-control" not in headers:
         return
 
-    cache_control = headers["cache-control"].lower()
+    cache_control = headers["cache-control"]
     # If the Cache-Control header contains no-store, don't cache the response
-    if "no-store" in cache_control:
+    if NO_STORE_PATTERN.search(cache_control):
         return
 
     # If the Cache-Control header contains max-age, cache the response
-    if "max-age" in cache_control:
+    match = MAX_AGE_PATTERN.search(cache_control)
+    if match:
         # Get the max-age value
-        max_age = int(cache_control.split("max-age=")[1])
-        # If the value is a number, cache the response
+        max_age = int(match.group(1))
+        # If the value is more than zero seconds, cache the response
         if max_age:
             expiration_time = time.time() + max_age
             # Cache the response by adding it to the cache dictionary
-            CACHE[url] = (headers, body, expiration_time)
+            with CACHE_LOCK:
+                CACHE[url] = (headers, body, expiration_time)
+                heapq.heappush(EXPIRATIONS, (expiration_time, url))
             return
 
 
+# Remove every page whose time in the cache is up
+def evict_expired():
+    now = time.time()
+    with CACHE_LOCK:
+        while EXPIRATIONS and EXPIRATIONS[0][0] <= now:
+            _, url = heapq.heappop(EXPIRATIONS)
+            # The page may have been removed already, when it was requested
+            # after it expired, or cached again with a later expiration time
+            if url in CACHE and CACHE[url][2] <= now:
+                CACHE.pop(url, None)
+
+
+# Connect to the host on the specified port, wrapping the connection in TLS if
+# the scheme is "https". Returns the connected socket.
+def connect(scheme, host, port):
+    # Create a new socket object and connect it to the host on the specified port
+    s = socket.socket(
+        # A socket has an address family, which tells you how to find the other
+        # computer. Address families have names that begin with AF. We want
+        # AF_INET, but for example AF_BLUETOOTH is another.
+        family=socket.AF_INET,
+        # A socket has a type, which describes the sort of conversation that’s
+        # going to happen. Types have names that begin with SOCK. We want
+        # SOCK_STREAM, which means each computer can send arbitrary amounts of
+        # data over, but there’s also SOCK_DGRAM, in which case they send each
+        # other packets of some fixed size.
+        type=socket.SOCK_STREAM,
+        # A socket has a protocol, which describes the steps by which the two
+        # computers will establish a connection. Protocols have names that
+        # depend on the address family, but we want IPPROTO_TCP.
+        proto=socket.IPPROTO_TCP,
+    )
+    # Connecting by name looks the host up in DNS every time, but we only
+    # connect once per server as long as it keeps the connection alive (see
+    # send), so the lookup isn't repeated for every request. We pass the name
+    # rather than an address we looked up and cached ourselves because the
+    # course's test harness replaces sockets with a mock that expects the host
+    # name, and its test hosts, like test.test, don't resolve at all.
+    s.connect((host, port))
+
+    # The difference between http and https is that https is more secure—but
+    # let’s be a little more specific. The https scheme, or more formally HTTP
+    # over TLS, is identical to the normal http scheme, except that all
+    # communication between the browser and the host is encrypted.
+
+    # If the scheme is "https", wrap the socket in an SSL context
+    if scheme == "https":
+        # Making an encrypted connection with ssl is pretty easy. Suppose you’ve
+        # already created a socket, s, and connected it to example.org. To
+        # encrypt the connection, you use ssl.create_default_context to create
+        # a context ctx and use that context to wrap the socket s.
+        # Creating a context loads and parses every trusted certificate on the
+        # system, so we only do it for the first HTTPS connection and reuse
+        # the same context for every connection after that.
+        global SSL_CONTEXT
+        if SSL_CONTEXT is None:
+            SSL_CONTEXT = ssl.create_default_context()
+        s = SSL_CONTEXT.wrap_socket(s, server_hostname=host)
+
+        # When you wrap s, you pass a server_hostname argument, and it should
+        # match the argument you passed to s.connect. Note that I save the new
+        # socket back into the s variable. That’s because you don’t want to send
+        # over the original socket; it would be unencrypted and also confusing.
+
+    return s
+
+
+# Send a request to the server, reusing an open connection to it if we have
+# one, or making a new connection otherwise. Returns the socket and a file to
+# read the response from.
+def send(scheme, host, port, request_bytes):
+    connections = CONNECTIONS.get((scheme, host, port), [])
+    while True:
+        # Another thread (see request_many) may take the last connection
+        # between checking the list and popping from it, so just try to pop
+        try:
+            s, response = connections.pop()
+        except IndexError:
+            break
+
+        # The server may have closed the connection while it sat unused, in
+        # which case either sending fails or there's no response to read (peek
+        # returns no bytes once the server has closed its end). If so, throw
+        # the connection away and try the next one.
+        try:
+            s.send(request_bytes)
+            if response.peek(1):
+                return s, response
+        except OSError:
+            pass
+        s.close()
+
+    s = connect(scheme, host, port)
+    s.send(request_bytes)
+    # Read the response as bytes rather than text, since Content-Length and
+    # chunk sizes count bytes, not characters. (The encoding and newline
+    # arguments only apply to text mode.)
+    return s, s.makefile("rb", encoding=None, newline=None)
+
+
+# Read the body of a response. With a Content-Length header, the body is
+# exactly that many bytes; with chunked transfer encoding, it is a series of
+# chunks, each preceded by its size in hex and ending with an empty chunk.
+# Some responses never have a body, and otherwise, the body runs until the
+# server closes the connection.
+# Returns the body, as bytes, and whether the connection can be reused.
+def read_body(version, status, headers, response):
+    # HTTP/1.1 connections stay open unless the server says otherwise, while
+    # HTTP/1.0 ones only stay open if the server says so.
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.1":
+        keep_alive = connection != "close"
+    else:
+        keep_alive = connection == "keep-alive"
+
+    # Informational (1xx), No Content (204), and Not Modified (304) responses
+    # never have a body, whatever their headers say
+    if status.startswith("1") or status in ("204", "304"):
+        return b"", keep_alive
+
+    if "content-length" in headers:
+        return response.read(int(headers["content-length"])), keep_alive
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            # The size may be followed by ;-separated extensions we ignore
+            size = int(response.readline().split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            chunks.append(response.read(size))
+            response.readline()  # The \r\n after the chunk
+        # Skip any trailer headers, up to the blank line ending the response
+        while response.readline() not in (b"\r\n", b""):
+            pass
+        return b"".join(chunks), keep_alive
+
+    # We never look at the body of a redirect, and when it doesn't say how
+    # long it is, reading it to the end of a connection the server keeps open
+    # would wait until the server gives up on us, so don't try. We don't know
+    # where the body ends, though, so the connection can't be used again.
+    if status.startswith("3"):
+        return b"", False
+
+    return response.read(), False
+
+
 # Make HTTP/HTTPS requests
 # Returns a tuple of (headers, body) where headers is a dictionary and body is a
 # string
 def request(url, headers=None):
+    headers, body = request_bytes(url, headers)
+    return headers, decode_body(headers, body)
+
+
+# Like request, but returns the body as the raw bytes the server sent, without
+# decoding it. Callers that only pass the body along, or that can do their work
+# on bytes, can then decode just the part of it they need, once, at the end.
+def request_bytes(url, headers=None):
+    # Redirects: Error codes in the 300 range request a redirect.
+    # When your browser encounters one, it should make a new request to the URL
+    # given in the Location header. Sometimes the Location header is a full URL,
+    # but sometimes it skips the host and scheme and just starts with a /
+    # (meaning the same host and scheme as the original request). The new URL
+    # might itself be a redirect, so make sure to handle that case. You don’t,
+    # however, want to get stuck in a redirect loop, so make sure limit how many
+    # redirects your browser can follow in a row. You can test this with with
+    # the URL http://browser.engineering/redirect, which redirects back to this
+    # page.
+    # We follow the redirects in a loop, making each request with the headers
+    # the caller asked for, not the headers of the redirect response.
+    for _ in range(MAX_REDIRECTS + 1):
+        status, response_headers, body = fetch(url, headers)
+        if not status.startswith("3"):
+            return response_headers, body
+
+        location = response_headers["location"]
+        if location.startswith("/"):
+            scheme, rest = url.split("://", 1)
+            location = f"{scheme}://{rest.split('/', 1)[0]}{location}"
+        url = location
+
+    raise Exception(f"Too many redirects, last to {url}")
+
+
+# Make a single request, without following redirects. Returns a tuple of
+# (status, headers, body), where status is the status code as a string, like
+# "200", and body is bytes.
+def fetch(url, headers=None):
     if url == "about:bookmarks":
-        body = "<!doctype html>\n"
-        for bookmark in BOOKMARKS:
-            body += '<a href="{}">{}</a><br>\n'.format(bookmark, bookmark)
-        return None, body
-
-    # Check the cache for the URL
-    if url in CACHE:
-        headers, body, expiration_time = CACHE[url]
-        # If the URL hasn't expired in the cache, return the cached response
-        # That is, if the current time is less than the expiration time
-        if time.time() < expiration_time:
-            return headers, body
-
-        # The URL has expired, remove it from the cache
-        del CACHE[url]
+        # Join the links together in one go, rather than adding them to the
+        # page one at a time, which copies the whole page for every bookmark
+        body = "<!doctype html>\n" + "".join(
+            f'<a href="{bookmark}">{bookmark}</a><br>\n' for bookmark in BOOKMARKS
+        )
+        return "200", None, body.encode("utf8")
+
+    # Clear out any pages that have expired, then check the cache for the URL
+    evict_expired()
+    with CACHE_LOCK:
+        cached = CACHE.get(url)
+        if cached is not None:
+            headers, body, expiration_time = cached
+            # If the URL hasn't expired in the cache, return the cached
+            # response. That is, if the current time is less than the
+            # expiration time
+            if time.time() < expiration_time:
+                return "200", headers, body
+
+            # The URL has expired, remove it from the cache
+            CACHE.pop(url, None)
 
     full_url = url
 
@@ -85,8 +360,8 @@ def request(url, headers=None):
     # If the scheme is "file", we're looking at a local file, so open it and
     # return the contents
     if scheme == "file":
-        with open(url) as f:
-            return {}, f.read()
+        with open(url, "rb") as f:
+            return "200", {}, f.read()
 
     # Split the URL into host and path parts based on the presence of `/`
     # So for example, "example.org:8080/index.html" becomes "example.org:8080"
@@ -108,60 +383,23 @@ def request(url, headers=None):
         host, port = host.split(":", 1)
         port = int(port)
 
-    # Create a new socket object and connect it to the host on the specified port
-    s = socket.socket(
-        # A socket has an address family, which tells you how to find the other
-        # computer. Address families have names that begin with AF. We want
-        # AF_INET, but for example AF_BLUETOOTH is another.
-        family=socket.AF_INET,
-        # A socket has a type, which describes the sort of conversation that’s
-        # going to happen. Types have names that begin with SOCK. We want
-        # SOCK_STREAM, which means each computer can send arbitrary amounts of
-        # data over, but there’s also SOCK_DGRAM, in which case they send each
-        # other packets of some fixed size.
-        type=socket.SOCK_STREAM,
-        # A socket has a protocol, which describes the steps by which the two
-        # computers will establish a connection. Protocols have names that
-        # depend on the address family, but we want IPPROTO_TCP.
-        proto=socket.IPPROTO_TCP,
-    )
-    s.connect((host, port))
-
-    # The difference between http and https is that https is more secure—but
-    # let’s be a little more specific. The https scheme, or more formally HTTP
-    # over TLS, is identical to the normal http scheme, except that all
-    # communication between the browser and the host is encrypted.
-
-    # If the scheme is "https", wrap the socket in an SSL context
-    if scheme == "https":
-        # Making an encrypted connection with ssl is pretty easy. Suppose you’ve
-        # already created a socket, s, and connected it to example.org. To
-        # encrypt the connection, you use ssl.create_default_context to create
-        # a context ctx and use that context to wrap the socket s.
-        ctx = ssl.create_default_context()
-        s = ctx.wrap_socket(s, server_hostname=host)
-
-        # When you wrap s, you pass a server_hostname argument, and it should
-        # match the argument you passed to s.connect. Note that I save the new
-        # socket back into the s variable. That’s because you don’t want to send
-        # over the original socket; it would be unencrypted and also confusing.
-
     # Send an HTTP GET request to the server for the specified path
-    # Default headers to send
-    request_headers = {
-        "host": host,
-        "connection": "close",
-        "user-agent": "abosh",
-    }
+    # Default headers to send. We ask the server to keep the connection open
+    # after it responds, so that the next request to it can skip connecting
+    # (and, for HTTPS, the TLS handshake) all over again.
+    request_headers = CaseInsensitiveDict()
+    request_headers["host"] = host
+    request_headers["connection"] = "keep-alive"
+    request_headers["user-agent"] = "abosh"
 
     # If the `headers` argument includes headers that are sent by default, like `User-Agent`,
     # the `headers` argument should overwrite their value.
     # In other words, the request should only contain one occurrence of each header.
     if headers:
-        # Can probably use request_headers.update(headers) here, but
-        # I want to do a case-insenstive lookup
+        # We can't use request_headers.update(headers) here, since update
+        # skips the lowercasing that makes the lookup case-insensitive
         for key, value in headers.items():
-            request_headers[key.lower()] = value
+            request_headers[key] = value
 
     # Convert the headers into a string. Don't forget we need the blank line at the end!
     header_str = (
@@ -169,14 +407,15 @@ def request(url, headers=None):
         + "\r\n"
     )
 
-    request_str = f"GET {path} HTTP/1.1\r\n{header_str}\r\n".encode("utf8")
-    s.send(request_str)
+    # header_str already ends with the blank line that ends the request; any
+    # more would be read as the start of the next request on this connection
+    request_str = f"GET {path} HTTP/1.1\r\n{header_str}".encode("utf8")
+    s, response = send(scheme, host, port, request_str)
 
-    # Read the server's response
-    response = s.makefile("r", encoding="utf8", newline="\r\n")
-
-    # Parse the status line and check that the status code is 200 OK
-    statusline = response.readline()
+    # Parse the status line and check that the status code is 200 OK. The
+    # status line and headers are Latin-1 (ISO-8859-1), which maps each byte
+    # straight to one character, so decoding them never fails.
+    statusline = response.readline().decode("iso-8859-1")
     version, status, explanation = statusline.split(" ", 2)
 
     # Note that I do not check that the server’s version of HTTP is the same as
@@ -190,72 +429,117 @@ def request(url, headers=None):
     )
 
     # Parse the headers and fill a map of header names to header values,
-    # stripping whitespace from the values
-    headers = {}
+    # stripping whitespace from the values. We slice around the colon rather
+    # than splitting on it, which would build a list for every header.
+    headers = CaseInsensitiveDict()
     while True:
-        line = response.readline()
-        if line == "\r\n":
+        line = response.readline().decode("iso-8859-1")
+        # The headers end with a blank line. Some servers end lines with a
+        # bare \n, and a response cut short ends with no line at all (readline
+        # returns nothing at the end of the stream), which would otherwise
+        # have us waiting for more headers forever.
+        if line in ("\r\n", "\n", ""):
             break
-        header, value = line.split(":", 1)
-        headers[header.lower()] = value.strip()
-
-    # Redirects: Error codes in the 300 range request a redirect.
-    # When your browser encounters one, it should make a new request to the URL
-    # given in the Location header. Sometimes the Location header is a full URL,
-    # but sometimes it skips the host and scheme and just starts with a /
-    # (meaning the same host and scheme as the original request). The new URL
-    # might itself be a redirect, so make sure to handle that case. You don’t,
-    # however, want to get stuck in a redirect loop, so make sure limit how many
-    # redirects your browser can follow in a row. You can test this with with
-    # the URL http://browser.engineering/redirect, which redirects back to this
-    # page.
-    if status.startswith("3"):
-        location = headers["location"]
-        if location.startswith("/"):
-            location = f"{scheme}://{host}{location}"
-
-        return request(location, headers)
+        colon = line.find(":")
+        # A line without a colon isn't a header, so whatever follows isn't
+        # headers either
+        if colon < 0:
+            break
+        headers[line[:colon]] = line[colon + 1 :].strip()
 
     # Headers can describe all sorts of information, but a couple of headers are
     # especially important because they tell us that the data we’re trying to
     # access is being sent in an unusual way. Let’s make sure none of those are
-    # present.
-    assert "transfer-encoding" not in headers, "Transfer encoding not supported"
+    # present, apart from chunked transfer encoding, which read_body handles.
+    assert headers.get("transfer-encoding", "chunked").lower() == "chunked", (
+        "Transfer encoding not supported"
+    )
     assert "content-encoding" not in headers, "Content encoding not supported"
 
-    # Read the body of the response and close the socket
-    body = response.read()
-    s.close()
+    # Read the body of the response. If the server is keeping the connection
+    # open, hand it back so the next request to the server can use it;
+    # otherwise close the socket.
+    body, reusable = read_body(version, status, headers, response)
+    if reusable:
+        CONNECTIONS.setdefault((scheme, host, port), []).append((s, response))
+    else:
+        s.close()
 
     # Cache the response if the response is 200
     if status == "200":
         cache(full_url, headers, body)
 
-    # Return the headers and body of the response
-    return headers, body
+    # Return the status, headers and body of the response
+    return status, headers, body
+
+
+# Decode the bytes of a response body into a string, using the charset the
+# Content-Type header gives, or UTF-8 if it doesn't give one we know. We decode
+# the whole body once, after reading it as raw bytes, rather than decoding it
+# bit by bit as it arrives, and replace any bytes that aren't valid in the
+# charset instead of giving up on the page.
+def decode_body(headers, body):
+    content_type = headers.get("content-type", "") if headers else ""
+    match = CHARSET_PATTERN.search(content_type)
+    charset = match.group(1) if match else "utf8"
+    try:
+        return body.decode(charset, errors="replace")
+    except LookupError:
+        return body.decode("utf8", errors="replace")
+
+
+# Make a request to each of several URLs at once. Each request runs on its own
+# thread, so the time spent waiting on the network overlaps rather than adding
+# up. Returns a list with, for each URL in order, either the (headers, body)
+# tuple that request returned or the exception it raised, so that one failed
+# request doesn't lose the others.
+def request_many(urls, headers=None):
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=MAX_CONCURRENT_REQUESTS
+    ) as executor:
+        futures = [executor.submit(request, url, headers) for url in urls]
+    return [future.exception() or future.result() for future in futures]
+
+
+# Remove HTML tags from a string and return the text that's left. Rather than
+# looking at every character in Python, we jump from each < straight to the >
+# that closes it with str.find, which scans in C, so the loop runs once per tag
+# instead of once per character. An unterminated tag (a < with no matching >)
+# runs to the end of the body, and a stray > outside of a tag is dropped, just
+# like the character-by-character version this replaced.
+# The body can also be bytes in an ASCII-compatible encoding like UTF-8, since
+# the bytes for < and > never show up inside any other character.
+def strip_tags(body):
+    lt_char, gt_char = ("<", ">") if isinstance(body, str) else (b"<", b">")
+    out = []
+    i = 0
+    while True:
+        lt = body.find(lt_char, i)
+        if lt < 0:
+            out.append(body[i:])
+            break
+        out.append(body[i:lt])
+        gt = body.find(gt_char, lt + 1)
+        if gt < 0:
+            break
+        i = gt + 1
+    return body[:0].join(out).replace(gt_char, body[:0])
 
 
 # Remove HTML tags from a string and print the result
 def show(body):
-    # Represents if we are currently inside an HTML tag
-    in_angle = False
-    for c in body:
-        if c == "<":
-            in_angle = True
-        elif c == ">":
-            in_angle = False
-        elif not in_angle:
-            print(c, end="")
+    # Write the text all at once, rather than calling print once per character
+    sys.stdout.write(strip_tags(body))
 
 
 # Load and display the contents of a web page given its URL
 def load(url):
-    headers, body = request(url)
-    show(body)
+    # Strip the tags from the raw bytes, so that we only decode the text that
+    # is actually shown rather than the whole page
+    headers, body = request_bytes(url)
+    sys.stdout.write(decode_body(headers, strip_tags(body)))
 
 
 # Load the web page specified by the first command-line argument
 if __name__ == "__main__":
-    import sys
-
     load(sys.argv[1])
@@ -1,23 +1,15 @@
+import bisect  # For finding the visible part of the display list
+import itertools  # For laying out a line of text at a time
 import sys  # For parsing command-line arguments
 import tkinter  # For the GUI
 import tkinter.font
 from chapter1 import request  # For getting the web page
+from chapter1 import strip_tags  # For stripping HTML tags
 
 
 # Remove HTML tags from a string. Return the resulting string.
 def lex(body):
-    text = ""
-    # Represents if we are currently inside an HTML tag
-    in_angle = False
-    for c in body:
-        if c == "<":
-            in_angle = True
-        elif c == ">":
-            in_angle = False
-        elif not in_angle:
-            text += c
-
-    return text
+    return strip_tags(body)
 
 
 # Fixed width and height for the browser window
@@ -35,29 +27,37 @@ SCROLL_STEP = 100
 # be drawn on the screen.
 def layout(text: str) -> list[tuple[int, int, str]]:
     display_list = []
-    # Point to where the next character will go, as if we were typing the
-    # text within a word processor.
-    cursor_x, cursor_y = HSTEP, VSTEP
-    for c in text:
-        if c == "\n":
-            # If the character is a newline character, increment y by
-            # more than VSTEP to give the illusion of paragraphs
-            cursor_y += 2 * VSTEP
-            cursor_x = HSTEP
-            continue
-
-        # Add the character to the display list with its x- and y-coordinates
-        display_list.append((cursor_x, cursor_y, c))
-
-        # Move the cursor to the right in the line
-        cursor_x += HSTEP
-
-        # Line breaks. Think of WIDTH - MARGIN as the margin on the right
-        # side of the window. If the cursor is at the margin, then adding
-        # the next character would go past the right edge of the window.
-        if cursor_x >= WIDTH - HSTEP:
-            cursor_y += VSTEP  # Move down to the next line
-            cursor_x = HSTEP  # Move to the left edge of the window
+
+    # How many characters fit on a line. The cursor wraps as soon as it
+    # reaches WIDTH - HSTEP, which leaves room for ceil(WIDTH / HSTEP) - 2
+    # characters, but we always fit at least one. (If the user has zoomed out
+    # so far that HSTEP is 0, the cursor never moves and so never wraps.)
+    # Every line starts at the left edge, so the x-coordinates of its
+    # characters are the same for every line, and we work them out just once.
+    if HSTEP:
+        line_length = max(1, -(-WIDTH // HSTEP) - 2)
+        xs = range(HSTEP, HSTEP * (line_length + 1), HSTEP)
+    else:
+        line_length = max(1, len(text))
+        xs = [0] * line_length
+
+    # Since every character is the same width, we don't need to simulate a
+    # typewriter one character at a time: a paragraph breaks into lines every
+    # line_length characters, and each line's characters just pair up with
+    # the x-coordinates above. zip does that pairing in C, so the Python loop
+    # runs once per line rather than once per character.
+    cursor_y = VSTEP
+    for paragraph in text.split("\n"):
+        y = cursor_y
+        for start in range(0, len(paragraph), line_length):
+            line = paragraph[start : start + line_length]
+            display_list.extend(zip(xs, itertools.repeat(y), line))
+            y += VSTEP
+
+        # Move down past every line of the paragraph (including the empty one
+        # we wrap onto if the last line was exactly full), then a bit more to
+        # give the illusion of paragraphs
+        cursor_y += VSTEP * (len(paragraph) // line_length) + 2 * VSTEP
 
     return display_list
 
@@ -72,8 +72,11 @@ class Browser:
         # window. Read more: https://www.tutorialspoint.com/python/tk_pack.htm
         self.canvas.pack(fill="both", expand=True)
 
-        # Create a font object to use for drawing text on the canvas
+        # Create a font object to use for drawing text on the canvas. We make
+        # it once up front and reuse it for every character, since creating a
+        # Tk font is expensive; it only needs replacing when we zoom.
         self.fontsize = 16
+        self.font = tkinter.font.Font(size=self.fontsize)
 
         # How many pixels has the user scrolled down
         self.scroll = 0
@@ -105,66 +108,78 @@ class Browser:
         # self.canvas.create_rectangle(10, 20, 400, 300)
 
         # Compute the display list for the text of the page
-        self.display_list = layout(self.text)
+        self.relayout()
         # Draw the text on the canvas
         self.draw()
 
+    # Compute the display list for the text of the page, along with the
+    # y-coordinate of every character in it. layout places characters top to
+    # bottom, so self.ys is sorted, which lets draw binary search it for the
+    # characters that are on screen.
+    def relayout(self) -> None:
+        self.display_list = layout(self.text)
+        self.ys = [y for _, y, _ in self.display_list]
+
     # Draws the text of the page on the canvas
     def draw(self):
         # Clear the canvas, since we don't want to draw on top of the old text
         self.canvas.delete("all")
-        for x, y, c in self.display_list:
-            if y > self.scroll + HEIGHT:
-                # In this case, think of self.scroll as the padding above the
-                # window on the page. So for example, if self.scroll was 100,
-                # then the top of the window would be 100 pixels below the top
-                # Then the plus HEIGHT is the bottom of the window, so if the
-                # HEIGHT is 600, then the bottom of the window would be 700
-                # If the y is greater than 700, then the character is below the
-                # bottom of the window, so we can skip drawing it
-                continue
-
-            if y + VSTEP < self.scroll:
-                # In this case, VSTEP represents the height of the character
-                # So y + VSTEP represents the bottom edge of the character to be
-                # drawn. Since self.scroll represents the padding above the
-                # window to be drawn, if the bottom edge of the character is
-                # above the top of the window, then we can skip drawing it
-                continue
-
-            # Only draw the character if it's in the visible part of the window
+
+        # The visible part of the page doesn't change while we draw, so work
+        # out its edges once rather than for every character. Think of
+        # self.scroll as the padding above the window on the page: if
+        # self.scroll was 100, then the top of the window would be 100 pixels
+        # below the top of the page, and with a HEIGHT of 600 the bottom of the
+        # window would be 700 pixels below it.
+        top, bottom = self.scroll, self.scroll + HEIGHT
+        # Look up the canvas method and font once, too; draw calls them for
+        # every visible character.
+        create_text, font = self.canvas.create_text, self.font
+
+        # Rather than checking every character on the page, binary search for
+        # the first and last ones on screen. VSTEP represents the height of a
+        # character, so a character at y is visible if its bottom edge,
+        # y + VSTEP, is at or below the top of the window, and its top edge, y,
+        # is at or above the bottom of the window.
+        start = bisect.bisect_left(self.ys, top - VSTEP)
+        end = bisect.bisect_right(self.ys, bottom)
+        for x, y, c in self.display_list[start:end]:
             # self.scroll represents the padding above the window to be drawn
             # So y - self.scroll represents the y-coordinate of the character
             # relative to the top of the window, since we are subtracting
             # this padding from y. Thus, we can draw the character at this
             # y-coordinate relative to the top of the window, regardless
             # of the actual y-coordinate of the character on the page
-            self.canvas.create_text(
-                x, y - self.scroll, text=c, font=tkinter.font.Font(size=self.fontsize)
-            )
+            create_text(x, y - top, text=c, font=font)
+
+    # Scroll to the given number of pixels down the page and redraw. Make sure
+    # that the user cannot scroll up past the top of the page.
+    def scrollto(self, scroll: int) -> None:
+        # If the user has scrolled up past the top of the page, then scroll
+        # will be negative. In this case, we want to set it to 0, since we
+        # don't want to scroll up past the top of the page.
+        scroll = max(scroll, 0)
+
+        # Redrawing deletes and recreates every visible character, so skip it
+        # if the page hasn't actually moved, like when the user keeps
+        # pressing the up arrow key at the top of the page
+        if scroll == self.scroll:
+            return
+
+        self.scroll = scroll
+        # Redraw the text on the canvas
+        self.draw()
 
     # Scroll down when the down arrow key is pressed
     def scrolldown(self, event: object) -> None:
         # Add the scroll step to the scroll variable
-        self.scroll += SCROLL_STEP
-        # Redraw the text on the canvas
-        self.draw()
+        self.scrollto(self.scroll + SCROLL_STEP)
 
     # Scroll up when the up arrow key is pressed. Make sure that the user
     # cannot scroll up past the top of the page.
     def scrollup(self, event: object) -> None:
         # Subtract the scroll step from the scroll variable
-        self.scroll -= SCROLL_STEP
-
-        # If the user has scrolled up past the top of the page, then
-        # self.scroll will be negative. In this case, we want to set
-        # self.scroll to 0, since we don't want to scroll up past the top
-        # of the page.
-        if self.scroll < 0:
-            self.scroll = 0
-
-        # Redraw the text on the canvas
-        self.draw()
+        self.scrollto(self.scroll - SCROLL_STEP)
 
     # Scroll up or down when the mouse wheel is scrolled. Make sure that the
     # user cannot scroll up past the top of the page.
@@ -176,17 +191,7 @@ class Browser:
         # This is why we subtract the delta from the scroll variable. For
         # example, if scroll was 100, and delta was 10, then we would set
         # scroll to 90, which would scroll the page up by 10 pixels
-        self.scroll -= event.delta
-
-        # If the user has scrolled up past the top of the page, then
-        # self.scroll will be negative. In this case, we want to set
-        # self.scroll to 0, since we don't want to scroll up past the top
-        # of the page.
-        if self.scroll < 0:
-            self.scroll = 0
-
-        # Redraw the text on the canvas
-        self.draw()
+        self.scrollto(self.scroll - event.delta)
 
     # Resize the canvas when the window is resized. This method is bound to
     # the <Configure> event, which fires when the window is resized
@@ -196,13 +201,25 @@ class Browser:
         # fields of the event object, since we bound this method to the
         # <Configure> event, which fires when the window is resized
         global WIDTH, HEIGHT
+
+        # Tk also fires <Configure> when the window merely moves, and keeps
+        # firing it while the user drags its corner, so don't redo any work
+        # for events that leave the size as it was
+        if (event.width, event.height) == (WIDTH, HEIGHT):
+            return
+
+        # Line breaks only depend on the width of the window, so if only the
+        # height has changed, the display list is still correct and we just
+        # need to draw more or less of it
+        width_changed = event.width != WIDTH
         WIDTH = event.width
         HEIGHT = event.height
 
         # Compute the display list for the text of the page again, since
         # the width of the window has changed and the text needs to be
         # re-laid out
-        self.display_list = layout(self.text)
+        if width_changed:
+            self.relayout()
 
         # Redraw the text on the canvas
         self.draw()
@@ -211,6 +228,7 @@ class Browser:
     def zoomin(self, event: object) -> None:
         # Double the font size, because the user pressed the + key
         self.fontsize *= 2
+        self.font = tkinter.font.Font(size=self.fontsize)
 
         # Also double the vertical and horizontal step size, since the
         # characters are now twice as big. This is necessary because the
@@ -222,7 +240,7 @@ class Browser:
 
         # Compute the display list for the text of the page again, since
         # the font size has changed and the text needs to be re-laid out
-        self.display_list = layout(self.text)
+        self.relayout()
 
         # Redraw the text on the canvas
         self.draw()
@@ -231,6 +249,7 @@ class Browser:
     def zoomout(self, event: object) -> None:
         # Half the font size, because the user pressed the - key
         self.fontsize //= 2  # We want an integer, so we use the // operator
+        self.font = tkinter.font.Font(size=self.fontsize)
 
         # Also half the vertical and horizontal step size, since the
         # characters are now half as big. This is necessary because the
@@ -242,7 +261,7 @@ class Browser:
 
         # Compute the display list for the text of the page again, since
         # the font size has changed and the text needs to be re-laid out
-        self.display_list = layout(self.text)
+        self.relayout()
 
         # Redraw the text on the canvas
         self.draw()
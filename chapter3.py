@@ -1,3 +1,6 @@
+import bisect  # For finding the visible part of the display list
+import itertools  # For indexing the display list by y-coordinate
+import re  # For splitting tags and replacing HTML entities
 import sys  # For parsing command-line arguments
 import tkinter  # For the GUI
 import tkinter.font as tkfont
@@ -9,6 +12,15 @@ from chapter2 import WIDTH, HEIGHT, HSTEP, VSTEP, SCROLL_STEP
 
 # A class to represent a string of text
 class Text:
+    # Whether this token is text rather than a tag. Layout checks this for
+    # every token, and reading a class attribute is cheaper than isinstance.
+    is_text = True
+
+    # A page has thousands of tokens, so we declare the one attribute each
+    # token has up front. That way, instances don't each carry a dictionary
+    # of attributes, which saves memory and makes the attribute faster to read.
+    __slots__ = ("text",)
+
     def __init__(self, text):
         self.text = text
 
@@ -18,8 +30,17 @@ class Text:
 
 # A class to represent an HTML tag
 class Tag:
+    # See Text.is_text and Text.__slots__
+    is_text = False
+    __slots__ = ("tag", "name")
+
     def __init__(self, tag):
         self.tag = tag
+        # The name of the tag on its own, without any attributes, and in lower
+        # case, since HTML tag names aren't case-sensitive. For example, the
+        # name of the tag "H1 class=title" is "h1". We work it out once here so
+        # that Layout can compare names exactly.
+        self.name = tag.split(maxsplit=1)[0].lower() if tag.strip() else ""
 
     def __repr__(self):
         return "Tag('{}')".format(self.tag)
@@ -27,38 +48,54 @@ class Tag:
 
 Token = Union[Text, Tag]
 
+# The HTML entities we support, and the characters they stand for
+ENTITIES = {"&lt;": "<", "&gt;": ">", "&amp;": "&", "&quot;": '"'}
+# Matches any of the entities above, so that we can replace all of them in one
+# pass over the text
+ENTITY_PATTERN = re.compile("|".join(ENTITIES))
+
+
+# Matches the < and > that start and end an HTML tag, capturing them so that
+# splitting on it keeps them
+DELIMITER_PATTERN = re.compile("([<>])")
+
+
+# Replace the HTML entities in a string of text with the characters they stand
+# for. Every entity starts with an &, so most text, which has none, doesn't
+# need to be scanned for them at all.
+def replace_entities(text: str) -> str:
+    if "&" not in text:
+        return text
+    return ENTITY_PATTERN.sub(lambda match: ENTITIES[match.group()], text)
+
 
 # Remove HTML tags from a string. Return the resulting string.
 def lex(body: str) -> list[Token]:
     # The list of tokens to return
     out = []
+    # Rather than looking at the body one character at a time in Python, split
+    # it on every < and > in one pass of the (C-implemented) regex engine. That
+    # leaves the text between each pair of delimiters, with the delimiters
+    # themselves in between, like ["a", "<", "b", ">", "c"], so the loop below
+    # runs once per delimiter instead of once per character.
+    pieces = DELIMITER_PATTERN.split(body)
     # Represents the text between HTML tags
-    text = ""
+    text = pieces[0]
     # Represents if we are currently inside an HTML tag
     in_tag = False
-    for c in body:
-        if c == "<":
+    for i in range(1, len(pieces), 2):
+        if pieces[i] == "<":
             in_tag = True
             if text:
                 # Replace HTML entities with their corresponding characters
-                text = (
-                    text.replace("&lt;", "<")
-                    .replace("&gt;", ">")
-                    .replace("&amp;", "&")
-                    .replace("&quot;", '"')
-                )
-
-                out.append(Text(text))
-                text = ""
-        elif c == ">":
+                out.append(Text(replace_entities(text)))
+        else:
             in_tag = False
             out.append(Tag(text))
-            text = ""
-        else:
-            text += c
+        text = pieces[i + 1]
 
     if not in_tag and text:
-        out.append(Text(text))
+        out.append(Text(replace_entities(text)))
 
     return out
 
@@ -68,19 +105,66 @@ def lex(body: str) -> list[Token]:
 FONTS = {}
 
 
-# Return a tkinter font object for the given size, weight, and slant
-def get_font(size: int, weight: str, slant: str, family: str) -> tkfont.Font:
-    # The keys to this dictionary will be size/weight/style triples, and the
-    # values will be Font objects.
+# Return a tkinter font object for the given size, weight, slant, and family.
+# If no family is given, Tk's default font family is used.
+def get_font(size: int, weight: str, slant: str, family: str = None) -> tkfont.Font:
+    # The keys to this dictionary will be size/weight/style/family tuples, and
+    # the values will be Font objects.
+    # Look the font up just once, rather than checking whether it's there and
+    # then looking it up again, since layout asks for a font for every token.
     key = (size, weight, slant, family)
-    if key not in FONTS:
-        font = tkfont.Font(size=size, weight=weight, slant=slant, family=family)
+    font = FONTS.get(key)
+    if font is None:
+        # Only pass the family along if there is one, since Tk would otherwise
+        # look for a font family called "None"
+        options = {"family": family} if family else {}
+        font = tkfont.Font(size=size, weight=weight, slant=slant, **options)
         FONTS[key] = font
-    return FONTS[key]
+    return font
+
+
+# The widths of the words we've measured in each font. Measuring text is a
+# round trip to Tk, and it's most of the work of laying out a page, but the
+# same words (and spaces) come up again and again, and every relayout after a
+# resize measures them all over again, so we only ask Tk once per word and
+# font. Tk fonts can't be dictionary keys, so the key is the font's id, and the
+# value is the font itself along with a dictionary of its widths. Keeping the
+# font stops it being freed and having its id reused by a different font.
+WIDTHS = {}
+
+
+# Return the width of the given text in the given font
+def measure(font: tkfont.Font, text: str) -> float:
+    entry = WIDTHS.get(id(font))
+    if entry is None:
+        entry = WIDTHS[id(font)] = (font, {})
+    widths = entry[1]
+    width = widths.get(text)
+    if width is None:
+        width = widths[text] = font.measure(text)
+    return width
+
+
+# The metrics (ascent, descent, linespace, and so on) of each font. Like
+# widths, asking Tk for these is a round trip, but they never change for a
+# font, so we only ask once. The key and value work the same way as in WIDTHS.
+METRICS = {}
+
+
+# Return the metrics of the given font, as a dictionary
+def metrics(font: tkfont.Font) -> dict:
+    entry = METRICS.get(id(font))
+    if entry is None:
+        entry = METRICS[id(font)] = (font, font.metrics())
+    return entry[1]
 
 
 # A class to represent a word on a line of text
 class LineItem:
+    # There's one of these for every word on the page, so declare their
+    # attributes up front, like Text.__slots__
+    __slots__ = ("cursor_x", "text", "font", "superscript")
+
     def __init__(
         self, cursor_x: float, text: str, font: tkfont.Font, superscript: bool
     ):
@@ -94,6 +178,26 @@ class LineItem:
         self.superscript = superscript
 
 
+# The tags that just set a bit of the layout's state, mapped to the attribute
+# they set and the value they set it to. For example, <b> makes the text bold
+# by setting weight to "bold", and </b> sets it back to "normal".
+TAG_STATES = {
+    "i": ("style", "italic"),
+    "/i": ("style", "roman"),
+    "b": ("weight", "bold"),
+    "/b": ("weight", "normal"),
+    "sup": ("superscript", True),
+    "/sup": ("superscript", False),
+    "abbr": ("abbr", True),
+    "/abbr": ("abbr", False),
+    "pre": ("pre", True),
+    "/pre": ("pre", False),
+}
+
+# The tags that change the font size, mapped to how much they change it by
+TAG_SIZES = {"small": -2, "/small": 2, "big": 4, "/big": -4}
+
+
 # A class to represent a formatted block of text. Each Layout has a list of
 # tokens, and a list of (x, y, text, font) tuples to display. For example,
 # if the tokens are [Text('Hello'), Tag('b'), Text('world'), Tag('/b')], then
@@ -112,6 +216,11 @@ class Layout:
         self.cursor_x = HSTEP
         self.cursor_y = VSTEP
 
+        # How far right a word can reach before it has to wrap onto the next
+        # line. We check this for every word, so work it out once up front
+        # rather than looking up WIDTH and HSTEP each time.
+        self.line_end = WIDTH - HSTEP
+
         # The current font weight, style, and size
         self.weight = "normal"
         self.style = "roman"
@@ -137,59 +246,37 @@ class Layout:
         self.flush()
 
     def token(self, tok: Token) -> None:
-        if isinstance(tok, Text):
+        if tok.is_text:
             self.text(tok)
             return
 
-        # Otherwise, it's a tag (but still check)
-        assert isinstance(tok, Tag)
-        if tok.tag == "i":
-            self.style = "italic"
-        elif tok.tag == "/i":
-            self.style = "roman"
-        elif tok.tag == "b":
-            self.weight = "bold"
-        elif tok.tag == "/b":
-            self.weight = "normal"
-        elif tok.tag == "small":
-            self.size -= 2
-        elif tok.tag == "/small":
-            self.size += 2
-        elif tok.tag == "big":
-            self.size += 4
-        elif tok.tag == "/big":
-            self.size -= 4
+        # Otherwise, it's a tag
+        # Most tags just switch a bit of formatting on or off, so look up what
+        # they do in a table rather than comparing the tag to each of them
+        if tok.name in TAG_STATES:
+            attribute, value = TAG_STATES[tok.name]
+            setattr(self, attribute, value)
+        elif tok.name in TAG_SIZES:
+            self.size += TAG_SIZES[tok.name]
         # <br> tag ends the current line and starts a new one (self-closing tag)
-        elif tok.tag == "br":
+        elif tok.name == "br":
             self.flush()
         # Paragraphs are defined by the <p> and </p> tags, so </p> also ends
         # the current line.
-        elif tok.tag == "/p":
+        elif tok.name == "/p":
             self.flush()
             # I add a bit extra to cursor_y here to create a little gap between
             # paragraphs.
             self.cursor_y += VSTEP
         # The <h1> tag starts a new line, but it also centers the text.
-        elif tok.tag.startswith("h1"):
+        elif tok.name == "h1":
             self.flush()
             # self.cursor_y += VSTEP
             self.centered = True
         # The </h1> tag ends the current line and turns off centering.
-        elif tok.tag.startswith("/h1"):
+        elif tok.name == "/h1":
             self.flush()
             self.centered = False
-        elif tok.tag == "sup":
-            self.superscript = True
-        elif tok.tag == "/sup":
-            self.superscript = False
-        elif tok.tag == "abbr":
-            self.abbr = True
-        elif tok.tag == "/abbr":
-            self.abbr = False
-        elif tok.tag == "pre":
-            self.pre = True
-        elif tok.tag == "/pre":
-            self.pre = False
 
     # Add a string of text to the current line. This method is similar to the
     # text method, but it doesn't need to worry about HTML tags. It just needs
@@ -205,8 +292,8 @@ class Layout:
         superscript: bool = False,
         append_space: bool = True,
     ) -> None:
-        width = font.measure(text)
-        if self.cursor_x + width > WIDTH - HSTEP:
+        width = measure(font, text)
+        if self.cursor_x + width > self.line_end:
             self.flush()
 
         # Add the word to the line item list and move the cursor to the right
@@ -218,7 +305,7 @@ class Layout:
         self.cursor_x += width
         # Add a space to the end of the word
         if append_space:
-            self.cursor_x += font.measure(" ")
+            self.cursor_x += measure(font, " ")
 
     # Return a font object for the current font weight, style, and size.
     # For example, if the current font weight is bold, style is italic, and size
@@ -233,6 +320,7 @@ class Layout:
         scale: float = None,
         bold: bool = False,
         italic: bool = False,
+        family: str = None,
     ) -> tkfont.Font:
         # If the size is None, use the current size
         font_size = size if size else self.size
@@ -246,106 +334,102 @@ class Layout:
             font_size,
             "bold" if bold else self.weight,
             "italic" if italic else self.style,
+            family,
         )
 
     def process_abbr(self, font: tkfont.Font, word: str) -> str:
-        line_abbr = ""
-        # Whether the previous "chunk" of characters was lowercase
-        is_lowercase = word[0].islower()
-        for c in word:
-            # Case 1: The current character is not lowercase but the previous
-            # chunk of characters was lowercase. This means we need to draw the
-            # previous chunk of characters in small caps and clear the chunk.
-            if not c.islower() and is_lowercase:
-                self.append_line_item(
-                    cursor_x=self.cursor_x,
-                    text=line_abbr.upper(),  # caps
-                    font=self.get_font(scale=0.5, bold=True),  # small caps
-                    superscript=self.superscript,
-                    append_space=False,
-                )
-
-                line_abbr = ""
-                is_lowercase = not is_lowercase
-
-            # Case 2: The current character is lowercase but the previous chunk
-            # of characters was not lowercase. This means we need to draw the
-            # previous chunk of characters in the normal font and clear the
-            # chunk.
-            elif c.islower() and not is_lowercase:
-                self.append_line_item(
-                    cursor_x=self.cursor_x,
-                    text=line_abbr,
-                    font=font,  # normal font
-                    superscript=self.superscript,
-                    append_space=False,
-                )
-
-                line_abbr = ""
-                is_lowercase = not is_lowercase
-
-            # All cases: Add the current character to the chunk, since the
-            # chunk is either still all lowercase/uppercase or now empty.
-            line_abbr += c
-
-        # If there are any characters left over in the chunk, draw them in the
-        # appropriate font.
-        if line_abbr:
-            # Case 1: The last chunk of characters was lowercase.
-            # Draw them in small caps.
+        # The small caps font is the same for every run of lowercase letters,
+        # so only look it up once
+        small_caps_font = self.get_font(scale=0.5, bold=True)
+
+        # Split the word into runs of characters that are all lowercase or all
+        # not lowercase, like "Hello" into "H" and "ello", and draw each run
+        # in one go. groupby finds the runs for us, rather than us checking
+        # each character against the one before it.
+        for is_lowercase, run in itertools.groupby(word, key=str.islower):
+            run = "".join(run)
+            # Case 1: The run is lowercase. Draw it in small caps.
             if is_lowercase:
                 self.append_line_item(
                     cursor_x=self.cursor_x,
-                    text=line_abbr.upper(),  # caps
-                    font=self.get_font(scale=0.5, bold=True),  # small caps
+                    text=run.upper(),  # caps
+                    font=small_caps_font,  # small caps
                     superscript=self.superscript,
                     append_space=False,
                 )
-            # Case 2: The last chunk of characters was not lowercase.
-            # Draw them in the normal font.
+            # Case 2: The run is not lowercase. Draw it in the normal font.
             else:
                 self.append_line_item(
                     cursor_x=self.cursor_x,
-                    text=line_abbr,
+                    text=run,
                     font=font,  # normal font
                     superscript=self.superscript,
                     append_space=False,
                 )
 
         # Add a space to the end of the word.
-        self.cursor_x += font.measure(" ")
+        self.cursor_x += measure(font, " ")
 
     # Add a string of text to the current line
     def text(self, tok: Token) -> None:
         font = None
         if self.pre:
-            # Use Courier New as the font for preformatted text
-            font = tkinter.font.Font(family="Courier New", size=self.size)
+            # Use Courier New as the font for preformatted text. Like every
+            # other font, it comes from the FONTS cache, rather than making a
+            # new Tk font for every piece of preformatted text.
+            font = self.get_font(family="Courier New")
         elif self.superscript:
             font = self.get_font(scale=0.5)
         else:
             font = self.get_font()
 
         # Split the string into words
-        for word in tok.text.split():
-            if self.pre:
-                # If the text is preformatted, then we don't need to worry
-                # about splitting the text into words. We can just add the
-                # entire string to the line.
+        words = tok.text.split()
+
+        # Whether the text is preformatted or an abbreviation is the same for
+        # every word in the token, so check once and then loop over the words
+        # in the way that suits the text, rather than checking for each word.
+        if self.pre:
+            # If the text is preformatted, then we don't need to worry
+            # about splitting the text into words. We can just add the
+            # entire string to the line.
+            for word in words:
                 self.append_line_item(
                     cursor_x=self.cursor_x,
                     text=word,
                     font=font,
                     superscript=self.superscript,
                 )
-                continue
+            return
 
-            # Make the <abbr> element render text in small caps.
-            # Inside an <abbr> tag, lower-case letters should be small,
-            # capitalized, and bold, while all other characters (upper case,
-            # numbers, etc) should be drawn in the normal font.
-            if self.abbr:
+        # Make the <abbr> element render text in small caps.
+        # Inside an <abbr> tag, lower-case letters should be small,
+        # capitalized, and bold, while all other characters (upper case,
+        # numbers, etc) should be drawn in the normal font.
+        if self.abbr:
+            for word in words:
                 self.process_abbr(font, word)
+            return
+
+        # Look up the line end once for the whole token, rather than for every
+        # part of every word
+        line_end = self.line_end
+
+        for word in words:
+            # Most words have no soft hyphens, so there's nothing to split
+            # them on. For those, skip building a list of parts and looping
+            # over it, and just do what that loop would do with the one part:
+            # start a new line if the word (and a hyphen) won't fit on this
+            # one, then add the word.
+            if "\N{soft hyphen}" not in word:
+                if self.cursor_x + measure(font, word + "-") > line_end:
+                    self.flush()
+                self.append_line_item(
+                    cursor_x=self.cursor_x,
+                    text=word,
+                    font=font,
+                    superscript=self.superscript,
+                )
                 continue
 
             # Split the word on soft hyphens. This is useful for words that are
@@ -354,14 +438,28 @@ class Layout:
             # into "su", "per", "cal", "ifrag", etc. This way, we can fit the
             # word on multiple lines.
             line_prefix = ""
+            # Rather than measuring the prefix plus the next part plus a
+            # hyphen all over again for every part, which re-measures the
+            # whole prefix each time, we measure each part (and the hyphen) on
+            # its own and add the widths up. Text in a font is (very nearly)
+            # as wide as its pieces put together, and the pieces are much more
+            # likely to already be in the WIDTHS cache. That's close enough to
+            # decide where to break, but kerning can make the joined text a
+            # little narrower or wider, so the text we actually put on the
+            # line is measured as a whole.
+            hyphen_width = measure(font, "-")
+            # The width of line_prefix, without a hyphen
+            prefix_width = 0
             for h_word in word.split("\N{soft hyphen}"):
-                # Measure the width of the word, including the hyphen. This
-                # will be the width of the word if it is split on a hyphen.
-                width = font.measure(line_prefix + h_word + "-")
+                # Work out the width of the prefix plus this part, including
+                # the hyphen. This will be the width of the word if it is
+                # split on a hyphen after this part.
+                h_word_width = measure(font, h_word)
+                width = prefix_width + h_word_width + hyphen_width
 
                 # If adding the word to the line prefix would make the line too
                 # long, then flush the line and start a new one.
-                if self.cursor_x + width > WIDTH - HSTEP:
+                if self.cursor_x + width > line_end:
                     if line_prefix != "":
                         self.append_line_item(
                             cursor_x=self.cursor_x,
@@ -374,11 +472,13 @@ class Layout:
                     self.flush()
                     # Clear the line prefix
                     line_prefix = ""
+                    prefix_width = 0
 
                 # Add the word to the line prefix. At this point, either the
                 # line prefix is empty or the line prefix plus the word plus a
                 # hyphen will fit on the current line.
                 line_prefix += h_word
+                prefix_width += h_word_width
 
             # If there are any characters left over in the line prefix, draw
             # them in the appropriate font.
@@ -406,9 +506,9 @@ class Layout:
             return
 
         # Get the maximum ascent and descent for the line
-        metrics = [line_item.font.metrics() for line_item in self.line]
+        line_metrics = [metrics(line_item.font) for line_item in self.line]
         # Locate the tallest word
-        max_ascent = max([metric["ascent"] for metric in metrics])
+        max_ascent = max([metric["ascent"] for metric in line_metrics])
         # The line is then max_ascent below self.y—or actually a little more to
         # account for the leading
         baseline = self.cursor_y + 1.25 * max_ascent
@@ -440,7 +540,7 @@ class Layout:
             else:
                 # Note how y starts at the baseline, and moves UP by just enough
                 # to accomodate that word’s ascender.
-                cursor_y = baseline - line_item.font.metrics("ascent")
+                cursor_y = baseline - metrics(line_item.font)["ascent"]
 
             # Add the word to the display list
             self.display_list.append(
@@ -453,7 +553,7 @@ class Layout:
         self.line = []
 
         # The cursor_y field should be set to the baseline of the next line.
-        max_descent = max([metric["descent"] for metric in metrics])
+        max_descent = max([metric["descent"] for metric in line_metrics])
         # y must be far enough below baseline to account for the deepest
         # descender
         self.cursor_y = baseline + 1.25 * max_descent
@@ -500,16 +600,41 @@ class Browser:
         self.tokens = lex(body)
 
         # Compute the display list for the text of the page
-        self.display_list = Layout(self.tokens).display_list
+        self.relayout()
         # Draw the text on the canvas
         self.draw()
 
+    # Compute the display list for the text of the page, along with an index
+    # of it by y-coordinate so that draw can binary search for the words that
+    # are on screen. Words are laid out a line at a time, top to bottom, but
+    # within a line, taller words start higher up, so the y-coordinates
+    # themselves aren't quite sorted. Instead, we keep the highest y-coordinate
+    # of any word up to each word (self.max_ys) and the lowest y-coordinate of
+    # any word from each word on (self.min_ys), which are both sorted.
+    def relayout(self) -> None:
+        self.display_list = Layout(self.tokens).display_list
+        ys = [y for _, y, _, _ in self.display_list]
+        self.max_ys = list(itertools.accumulate(ys, max))
+        self.min_ys = list(itertools.accumulate(reversed(ys), min))[::-1]
+
     # Draws the text of the page on the canvas
     def draw(self):
         # Clear the canvas, since we don't want to draw on top of the old text
         self.canvas.delete("all")
-        for x, y, word, font in self.display_list:
-            if y > self.scroll + HEIGHT:
+
+        # Rather than checking every word on the page, binary search for the
+        # range of words that could be on screen. Every word before start is
+        # at least VSTEP above the top of the window, and every word from end
+        # on is below the bottom of the window, so the checks below would skip
+        # them all anyway.
+        # The edges of the window, and the canvas method we call for every
+        # word, don't change while we draw, so look them up just once
+        top, bottom = self.scroll, self.scroll + HEIGHT
+        create_text = self.canvas.create_text
+        start = bisect.bisect_left(self.max_ys, top - VSTEP)
+        end = bisect.bisect_right(self.min_ys, bottom)
+        for x, y, word, font in self.display_list[start:end]:
+            if y > bottom:
                 # In this case, think of self.scroll as the padding above the
                 # window on the page. So for example, if self.scroll was 100,
                 # then the top of the window would be 100 pixels below the top
@@ -519,7 +644,7 @@ class Browser:
                 # bottom of the window, so we can skip drawing it
                 continue
 
-            if y + VSTEP < self.scroll:
+            if y + VSTEP < top:
                 # In this case, VSTEP represents the height of the character
                 # So y + VSTEP represents the bottom edge of the character to be
                 # drawn. Since self.scroll represents the padding above the
@@ -527,7 +652,7 @@ class Browser:
                 # above the top of the window, then we can skip drawing it
                 continue
 
-            if y + font.metrics("linespace") < self.scroll:
+            if y + metrics(font)["linespace"] < top:
                 # In this case, font.metrics("linespace") represents the
                 # height of the line that the character is on. So y +
                 # font.metrics("linespace") represents the bottom edge of the
@@ -544,32 +669,36 @@ class Browser:
             # this padding from y. Thus, we can draw the character at this
             # y-coordinate relative to the top of the window, regardless
             # of the actual y-coordinate of the character on the page
-            self.canvas.create_text(
-                x, y - self.scroll, text=word, font=font, anchor="nw"
-            )
+            create_text(x, y - top, text=word, font=font, anchor="nw")
+
+    # Scroll to the given number of pixels down the page and redraw. Make sure
+    # that the user cannot scroll up past the top of the page.
+    def scrollto(self, scroll: int) -> None:
+        # If the user has scrolled up past the top of the page, then scroll
+        # will be negative. In this case, we want to set it to 0, since we
+        # don't want to scroll up past the top of the page.
+        scroll = max(scroll, 0)
+
+        # Redrawing deletes and recreates every visible word, so skip it if
+        # the page hasn't actually moved, like when the user keeps pressing
+        # the up arrow key at the top of the page
+        if scroll == self.scroll:
+            return
+
+        self.scroll = scroll
+        # Redraw the text on the canvas
+        self.draw()
 
     # Scroll down when the down arrow key is pressed
     def scrolldown(self, event: object) -> None:
         # Add the scroll step to the scroll variable
-        self.scroll += SCROLL_STEP
-        # Redraw the text on the canvas
-        self.draw()
+        self.scrollto(self.scroll + SCROLL_STEP)
 
     # Scroll up when the up arrow key is pressed. Make sure that the user
     # cannot scroll up past the top of the page.
     def scrollup(self, event: object) -> None:
         # Subtract the scroll step from the scroll variable
-        self.scroll -= SCROLL_STEP
-
-        # If the user has scrolled up past the top of the page, then
-        # self.scroll will be negative. In this case, we want to set
-        # self.scroll to 0, since we don't want to scroll up past the top
-        # of the page.
-        if self.scroll < 0:
-            self.scroll = 0
-
-        # Redraw the text on the canvas
-        self.draw()
+        self.scrollto(self.scroll - SCROLL_STEP)
 
     # Scroll up or down when the mouse wheel is scrolled. Make sure that the
     # user cannot scroll up past the top of the page.
@@ -581,17 +710,7 @@ class Browser:
         # This is why we subtract the delta from the scroll variable. For
         # example, if scroll was 100, and delta was 10, then we would set
         # scroll to 90, which would scroll the page up by 10 pixels
-        self.scroll -= event.delta
-
-        # If the user has scrolled up past the top of the page, then
-        # self.scroll will be negative. In this case, we want to set
-        # self.scroll to 0, since we don't want to scroll up past the top
-        # of the page.
-        if self.scroll < 0:
-            self.scroll = 0
-
-        # Redraw the text on the canvas
-        self.draw()
+        self.scrollto(self.scroll - event.delta)
 
     # Resize the canvas when the window is resized. This method is bound to
     # the <Configure> event, which fires when the window is resized
@@ -601,19 +720,37 @@ class Browser:
         # fields of the event object, since we bound this method to the
         # <Configure> event, which fires when the window is resized
         global WIDTH, HEIGHT
+
+        # Tk also fires <Configure> when the window merely moves, and keeps
+        # firing it while the user drags its corner, so don't redo any work
+        # for events that leave the size as it was
+        if (event.width, event.height) == (WIDTH, HEIGHT):
+            return
+
+        # Line breaks only depend on the width of the window, so if only the
+        # height has changed, the display list is still correct and we just
+        # need to draw more or less of it
+        width_changed = event.width != WIDTH
         WIDTH = event.width
         HEIGHT = event.height
 
         # Compute the display list for the text of the page again, since
         # the width of the window has changed and the text needs to be
         # re-laid out
-        self.display_list = Layout(self.tokens).display_list
+        if width_changed:
+            self.relayout()
 
         # Redraw the text on the canvas
         self.draw()
 
     # Zoom in when the + key is pressed.
     def zoomin(self, event: object) -> None:
+        global VSTEP, HSTEP
+        # Once the font size and steps have all been halved down to zero,
+        # doubling them leaves them at zero, so there's nothing to re-lay out
+        if not (self.fontsize or VSTEP or HSTEP):
+            return
+
         # Double the font size, because the user pressed the + key
         self.fontsize *= 2
 
@@ -621,19 +758,24 @@ class Browser:
         # characters are now twice as big. This is necessary because the
         # layout function uses the VSTEP and HSTEP variables to determine
         # where to place the characters on the page
-        global VSTEP, HSTEP
         VSTEP *= 2
         HSTEP *= 2
 
         # Compute the display list for the text of the page again, since
         # the font size has changed and the text needs to be re-laid out
-        self.display_list = Layout(self.tokens).display_list
+        self.relayout()
 
         # Redraw the text on the canvas
         self.draw()
 
     # Zoom out when the - key is pressed.
     def zoomout(self, event: object) -> None:
+        global VSTEP, HSTEP
+        # If the user has already zoomed out as far as possible, halving the
+        # font size and steps leaves them at zero, so there's nothing to do
+        if not (self.fontsize or VSTEP or HSTEP):
+            return
+
         # Half the font size, because the user pressed the - key
         self.fontsize //= 2  # We want an integer, so we use the // operator
 
@@ -641,13 +783,12 @@ class Browser:
         # characters are now half as big. This is necessary because the
         # layout function uses the VSTEP and HSTEP variables to determine
         # where to place the characters on the page
-        global VSTEP, HSTEP
         VSTEP //= 2
         HSTEP //= 2
 
         # Compute the display list for the text of the page again, since
         # the font size has changed and the text needs to be re-laid out
-        self.display_list = Layout(self.tokens).display_list
+        self.relayout()
 
         # Redraw the text on the canvas
         self.draw()
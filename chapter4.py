@@ -1,4 +1,5 @@
-import sys  # For parsing command-line arguments
+import re  # For finding the next tag in the HTML
+import sys  # For parsing command-line arguments and interning tag names
 import tkinter as tk  # For the GUI
 
 from typing import *
@@ -7,6 +8,10 @@ from chapter3 import Browser
 
 # A class to represent a string of text
 class Text:
+    # Like Element below, declare the attributes up front, since there's one
+    # of these for every run of text on the page
+    __slots__ = ("text", "children", "parent", "style")
+
     def __init__(self, text: str, parent):
         self.text = text
         self.children = (
@@ -20,11 +25,19 @@ class Text:
 
 
 class Element:
+    # There's one of these for every tag on the page, so declare their
+    # attributes up front rather than giving each one a dictionary of them.
+    # (style is set later on, when we compute styles in chapter 6.)
+    __slots__ = ("tag", "attributes", "children", "parent", "style", "layout_mode")
+
     def __init__(self, tag: str, attributes: dict[str, str], parent):
         self.tag = tag
         self.attributes = attributes
         self.children = []
         self.parent = parent
+        # Whether this element lays out as a block or inline, which chapter 5
+        # works out the first time it's asked and remembers here
+        self.layout_mode = None
 
     def __repr__(self):
         result = "<" + self.tag
@@ -36,44 +49,76 @@ class Element:
 
 Node = Union[Text, Element]
 
+# Matches the characters parse has to look at: the angle brackets that start or
+# end a tag, and the quotes that start and end quoted attributes inside one
+DELIMITER_PATTERN = re.compile("[<>\"']")
+# A comment, from <!-- to the next --> (or the end of the page, if the comment
+# is never closed)
+COMMENT_PATTERN = re.compile(r"<!--.*?(?:-->|\Z)", re.DOTALL)
+
+# One attribute of a tag: a key, and optionally an = followed by a value that's
+# double-quoted, single-quoted, or unquoted. Keys and unquoted values can't
+# contain spaces, quotes, backslashes, or =, and quoted values can't contain
+# backslashes, since get_attributes treats all of those specially.
+ATTRIBUTE_PATTERN = re.compile(
+    r"""([^ "'\\=]+)(?:=(?:"([^"\\]*)"|'([^'\\]*)'|([^ "'\\=]+)))?"""
+)
+# A list of attributes that get_attributes can read with ATTRIBUTE_PATTERN:
+# key-value pairs separated by spaces (which only unquoted values need), with
+# at most one key without a value, at the very end
+ATTRIBUTES_PATTERN = re.compile(
+    r"""(?: *[^ "'\\=]+=(?:"[^"\\]*"|'[^'\\]*'|[^ "'\\=]+(?= |$)))*"""
+    r"""(?: *[^ "'\\=]+)? *"""
+)
+
 
 # Parsing is a little more complex than lex, so we’re going to want to break it
 # into several functions, organized in a new HTMLParser class. That class can
 # also store the source code it’s analyzing and the incomplete tree.
 class HTMLParser:
-    # The tags that you’re supposed to put into the <head> element
-    HEAD_TAGS = [
-        "base",
-        "basefont",
-        "bgsound",
-        "noscript",
-        "link",
-        "meta",
-        "title",
-        "style",
-        "script",
-    ]
+    # The tags that you’re supposed to put into the <head> element. Like the
+    # other tag lists below, it's a frozenset, since we only ever check whether
+    # a tag is in it, and that's a single hash lookup rather than a scan.
+    HEAD_TAGS = frozenset(
+        [
+            "base",
+            "basefont",
+            "bgsound",
+            "noscript",
+            "link",
+            "meta",
+            "title",
+            "style",
+            "script",
+        ]
+    )
+
+    # The tags that don't close the <head> element: the head tags themselves,
+    # and an explicit </head>, which closes it anyway
+    HEAD_CLOSE_EXEMPT_TAGS = HEAD_TAGS | {"/head"}
 
     # Elements like <meta> and <link> are what are called self-closing: these tags
     # don’t surround content, so you don’t ever write </meta> or </link>. Our parser
     # needs special support for them. In HTML, there’s a specific list of these
     # self-closing tags (the spec calls them “void” tags):
-    SELF_CLOSING_TAGS = [
-        "area",
-        "base",
-        "br",
-        "col",
-        "embed",
-        "hr",
-        "img",
-        "input",
-        "link",
-        "meta",
-        "param",
-        "source",
-        "track",
-        "wbr",
-    ]
+    SELF_CLOSING_TAGS = frozenset(
+        [
+            "area",
+            "base",
+            "br",
+            "col",
+            "embed",
+            "hr",
+            "img",
+            "input",
+            "link",
+            "meta",
+            "param",
+            "source",
+            "track",
+            "wbr",
+        ]
+    )
 
     def __init__(self, body: str):
         self.body = body
@@ -85,120 +130,123 @@ class HTMLParser:
         # parents before children. First node in the list is the root of the
         # HTML tree; the last node in the list is the most recent unfinished tag.
         self.unfinished = []
+        # How many of the unfinished tags are paragraphs, so that
+        # open_paragraph doesn't have to look through all of them
+        self.open_paragraphs = 0
 
     # parse html
     def parse(self) -> Node:
-        # Text buffer
+        # Rather than building up the text between tags one character at a
+        # time, remember where it starts and slice it out in one go when we
+        # reach the end of it. Comments are the one thing that can interrupt it
+        # (like the one in <a <!-- x --> href=...>), so text holds whatever we
+        # sliced out before the most recent comment.
         text = ""
         # If we are inside a tag
         in_tag = False
-        in_comment = False
         in_single_quote = False
         in_double_quote = False
         # In a script tag
         in_script_tag = False
         current_tag = ""
-        i = 0  # current index in body
-
-        while i < len(self.body):
-            # Update the HTML lexer to support comments. Comments in HTML begin
-            # with <!-- and end with -->. However, comments aren’t the same as
-            # tags: they can contain any text, including left and right angle
-            # brackets. The lexer should skip comments, not generating any token
-            # at all. Check: is <!--> a comment, or does it just start one?
-            # Check for beginning of comment
-            if not in_comment and self.body[i : i + 4] == "<!--":
-                # Skip the opening of the comment
-                i += 4
-                in_comment = True
-                continue
-            # Check for end of comment
-            elif in_comment and self.body[i : i + 3] == "-->":
-                # Skip the ending of the comment
-                i += 3
-                in_comment = False
-                # If we're not in a tag, add the text to the tree.
-                if text and not in_tag:
-                    self.add_text(text)
-                    text = ""
-                continue
-            # If we're in a comment, skip the character. Don't generate
-            # any token at all for comments.
-            elif in_comment:
-                i += 1
-                continue
-
-            c = self.body[i]
-            # Quoted attributes can contain spaces and right angle brackets.
-            # Fix the lexer so that this is supported properly.
-            # Hint: the current lexer is a finite state machine, with two states
-            # (determined by in_tag). You’ll need more states.
-            if in_tag:
-                if c == '"' and not in_single_quote:
-                    in_double_quote = not in_double_quote
-                elif c == "'" and not in_double_quote:
-                    in_single_quote = not in_single_quote
 
-            # JavaScript code embedded in a <script> tag uses the left angle
-            # bracket to mean less-than. Modify your lexer so that the contents
-            # of <script> tags are treated specially: no tags are allowed inside
-            # <script>, except the </script> close tag.
-            if c == "<":
-                if in_script_tag:
-                    # Check for end of script tag
-                    if self.body[i : i + 9] == "</script>":
-                        in_script_tag = False
-                    # JavaScript code embedded in a <script> tag uses the left
-                    # angle bracket to mean less-than, so we need to add it to
-                    # the text, and not treat it as a tag.
-                    else:
-                        text += c
-                        i += 1
-                        continue
-                # If we encounter a < and we're in a quote, add it to the text
-                # because it's not a tag.
-                elif in_tag and in_single_quote or in_double_quote:
-                    text += c
-                    i += 1
-                    continue
+        # Update the HTML lexer to support comments. Comments in HTML begin
+        # with <!-- and end with -->. However, comments aren’t the same as
+        # tags: they can contain any text, including left and right angle
+        # brackets. The lexer should skip comments, not generating any token
+        # at all. Check: is <!--> a comment, or does it just start one?
+        # A comment starts at any <!--, whatever state we're in, so we can cut
+        # them all out up front, in C, with a regular expression, and then
+        # lex the chunks of the page between them.
+        for chunk_index, chunk in enumerate(COMMENT_PATTERN.split(self.body)):
+            # A comment ends any text before it, unless we're in a tag
+            if chunk_index and text and not in_tag:
+                self.add_text(text)
+                text = ""
 
-                # We are not in a tag, so we are starting a new tag.
-                in_tag = True
-                # If we have text, add it to the tree. This is the case where
-                # we have text before a tag.
-                if text:
-                    self.add_text(text)
+            text_start = 0
+            # Almost every character of a page, whether it's in text or a tag,
+            # is handled the same way, so rather than stepping through them one
+            # at a time in Python, let a regular expression find the ones that
+            # matter, in C: the < and > that start and end tags, and the quotes
+            # around attribute values. Everything in between is just part of
+            # the text, or of the tag. (Outside of a tag, quotes don't matter,
+            # and the loop below passes over them.)
+            for match in DELIMITER_PATTERN.finditer(chunk):
+                i = match.start()
+                c = match.group()
+                # Quoted attributes can contain spaces and right angle brackets.
+                # Fix the lexer so that this is supported properly.
+                # Hint: the current lexer is a finite state machine, with two
+                # states (determined by in_tag). You’ll need more states.
+                if in_tag:
+                    if c == '"' and not in_single_quote:
+                        in_double_quote = not in_double_quote
+                    elif c == "'" and not in_double_quote:
+                        in_single_quote = not in_single_quote
+
+                # JavaScript code embedded in a <script> tag uses the left angle
+                # bracket to mean less-than. Modify your lexer so that the
+                # contents of <script> tags are treated specially: no tags are
+                # allowed inside <script>, except the </script> close tag.
+                if c == "<":
+                    if in_script_tag:
+                        # Check for end of script tag (without slicing out a
+                        # copy of the next nine characters to compare)
+                        if chunk.startswith("</script>", i):
+                            in_script_tag = False
+                        # JavaScript code embedded in a <script> tag uses the
+                        # left angle bracket to mean less-than, so we need to
+                        # add it to the text, and not treat it as a tag.
+                        else:
+                            continue
+                    # If we encounter a < and we're in a quote, add it to the
+                    # text because it's not a tag.
+                    elif in_tag and in_single_quote or in_double_quote:
+                        continue
 
-                # Reset text
-                text = ""
+                    # We are not in a tag, so we are starting a new tag.
+                    in_tag = True
+                    # If we have text, add it to the tree. This is the case
+                    # where we have text before a tag.
+                    text += chunk[text_start:i]
+                    if text:
+                        self.add_text(text)
 
-            # Otherwise, we encountered a right angle bracket, which means
-            # we are ending a tag. We need to add the tag to the tree.
-            elif c == ">":
-                # If we're in a script tag, add the > to the text. This is because
-                # JavaScript code embedded in a <script> tag uses the right angle
-                # bracket to mean greater-than.
-                if in_script_tag:
-                    text += c
-                    i += 1
-                    continue
-                # If we encounter a > and we're in a quote, add it to the text
-                # as well because it's not a tag.
-                elif in_tag and in_single_quote or in_double_quote:
-                    text += c
-                    i += 1
-                    continue
+                    # Reset text, which now starts after the <
+                    text = ""
+                    text_start = i + 1
+
+                # Otherwise, we encountered a right angle bracket, which means
+                # we are ending a tag. We need to add the tag to the tree.
+                elif c == ">":
+                    # If we're in a script tag, add the > to the text. This is
+                    # because JavaScript code embedded in a <script> tag uses
+                    # the right angle bracket to mean greater-than.
+                    if in_script_tag:
+                        continue
+                    # If we encounter a > and we're in a quote, add it to the
+                    # text as well because it's not a tag.
+                    elif in_tag and in_single_quote or in_double_quote:
+                        continue
 
-                # Close the tag
-                in_tag = False
-                current_tag = self.add_tag(text)
-                # if current_tag and current_tag.tag == "script":
-                #     in_script_tag = True
-                text = ""
-            else:
-                text += c
+                    # Close the tag
+                    in_tag = False
+                    current_tag = self.add_tag(text + chunk[text_start:i])
+                    # Everything after a <script> tag, up to the </script>, is
+                    # script. add_tag returns the script element for the close
+                    # tag too, so make sure this one is the one we just opened.
+                    if (
+                        current_tag
+                        and current_tag.tag == "script"
+                        and current_tag is self.unfinished[-1]
+                    ):
+                        in_script_tag = True
+                    text = ""
+                    text_start = i + 1
 
-            i += 1
+            # Pick up the text after the last tag in the chunk
+            text += chunk[text_start:]
 
         if text and not in_tag:
             self.add_text(text)
@@ -224,6 +272,10 @@ class HTMLParser:
 
     def add_tag(self, tag: str) -> Node:
         tag, attributes = self.get_attributes(tag)
+        # The same few tag names come up over and over, so intern them: every
+        # <p> then shares one string, and comparing tags to names like "p"
+        # usually just compares pointers
+        tag = sys.intern(tag)
         # Ignore most comments and doctypes
         if tag.startswith("!"):
             return
@@ -239,6 +291,8 @@ class HTMLParser:
             # it to the next unfinished node in the list.
             # Get the most recent unfinished tag
             node = self.unfinished.pop()
+            if node.tag == "p":
+                self.open_paragraphs -= 1
             # Get the parent of the most recent unfinished tag
             parent = self.unfinished[-1]
             # Add the finished node as a child of the parent
@@ -296,6 +350,8 @@ class HTMLParser:
             node = Element(tag, attributes, parent)
             # Add it as a child of the most recent unfinished tag
             self.unfinished.append(node)
+            if tag == "p":
+                self.open_paragraphs += 1
 
         return node
 
@@ -304,16 +360,22 @@ class HTMLParser:
         # around the loop will add just one. To determine which implicit tag to
         # add, if any, requires examining the open tags and the tag being inserted.
         while True:
-            open_tags = [node.tag for node in self.unfinished]
+            # Only the first two open tags matter here, and only when there are
+            # at most two of them, so look at those rather than listing them all
+            depth = len(self.unfinished)
+            first = self.unfinished[0].tag if depth > 0 else None
+            second = self.unfinished[1].tag if depth > 1 else None
             # Let’s start with the easiest case, the implicit <html> tag. An
             # implicit <html> tag is necessary if the first tag in the document
             # is something other than <html>.
-            if open_tags == [] and tag != "html":
+            if depth == 0 and tag != "html":
                 self.add_tag("html")
 
             # Both <head> and <body> can also be omitted, but to figure out which
             # it is we need to look at which tag is being added
-            elif open_tags == ["html"] and tag not in ["head", "body", "/html"]:
+            elif (
+                depth == 1 and first == "html" and tag not in ("head", "body", "/html")
+            ):
                 if tag in self.HEAD_TAGS:
                     self.add_tag("head")
                 else:
@@ -323,7 +385,10 @@ class HTMLParser:
             # inside the <head> and sees an element that’s supposed to go in the
             # <body>
             elif (
-                open_tags == ["html", "head"] and tag not in ["/head"] + self.HEAD_TAGS
+                depth == 2
+                and first == "html"
+                and second == "head"
+                and tag not in self.HEAD_CLOSE_EXEMPT_TAGS
             ):
                 self.add_tag("/head")
 
@@ -338,10 +403,7 @@ class HTMLParser:
     # This is useful in add_tag to determine if we need to close the paragraph
     # tag before opening a new sibling one.
     def open_paragraph(self) -> bool:
-        for node in reversed(self.unfinished):
-            if isinstance(node, Element) and node.tag == "p":
-                return True
-        return False
+        return self.open_paragraphs > 0
 
     # Once the parser is done, it turns our incomplete tree into a complete tree
     # by just finishing any unfinished nodes.
@@ -371,6 +433,18 @@ class HTMLParser:
 
         tag, attrpairs = text.split(maxsplit=1)
         attributes = {}
+
+        # Almost every tag's attributes are simple key="value" pairs, which a
+        # regular expression can pick out in C rather than us stepping through
+        # them one character at a time. Save the loop below for the rest.
+        if ATTRIBUTES_PATTERN.fullmatch(attrpairs):
+            for match in ATTRIBUTE_PATTERN.finditer(attrpairs):
+                key, double_quoted, single_quoted, unquoted = match.groups()
+                attributes[sys.intern(key.lower())] = (
+                    double_quoted or single_quoted or unquoted or ""
+                )
+            return tag, attributes
+
         # Stores the current key and value being built
         current_key, current_value = "", ""
         # We need to keep track of whether we’re building a key or a value.
@@ -396,7 +470,7 @@ class HTMLParser:
                 # If we're not in a quoted string, we need to check if we're
                 else:
                     # Add the key-value pair to the attributes dictionary
-                    attributes[current_key.lower()] = current_value
+                    attributes[sys.intern(current_key.lower())] = current_value
                     # Reset the key and value buffers
                     current_key = ""
                     current_value = ""
@@ -427,7 +501,7 @@ class HTMLParser:
                 else:
                     if in_double_quote:
                         # Add the key-value pair to the attributes dictionary
-                        attributes[current_key.lower()] = current_value
+                        attributes[sys.intern(current_key.lower())] = current_value
                         # Reset the key and value buffers
                         current_key = ""
                         current_value = ""
@@ -445,7 +519,7 @@ class HTMLParser:
                 else:
                     if in_single_quote:
                         # Add the key-value pair to the attributes dictionary
-                        attributes[current_key.lower()] = current_value
+                        attributes[sys.intern(current_key.lower())] = current_value
                         # Reset the key and value buffers
                         current_key = ""
                         current_value = ""
@@ -468,7 +542,7 @@ class HTMLParser:
 
         # Add the last key-value pair to the attributes dictionary
         if current_key:
-            attributes[current_key.lower()] = current_value
+            attributes[sys.intern(current_key.lower())] = current_value
 
         return tag, attributes
 
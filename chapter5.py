@@ -6,72 +6,112 @@ without exercises.
 
 import socket
 import ssl
+import bisect
+import itertools
 import tkinter
 import tkinter.font
 from chapter1 import request
 from chapter2 import WIDTH, HEIGHT, HSTEP, VSTEP, SCROLL_STEP
-from chapter3 import FONTS, get_font
+from chapter3 import FONTS, get_font, measure, metrics
 from chapter4 import Text, Element, print_tree, HTMLParser
 
-BLOCK_ELEMENTS = [
-    "html",
-    "body",
-    "article",
-    "section",
-    "nav",
-    "aside",
-    "h1",
-    "h2",
-    "h3",
-    "h4",
-    "h5",
-    "h6",
-    "hgroup",
-    "header",
-    "footer",
-    "address",
-    "p",
-    "hr",
-    "pre",
-    "blockquote",
-    "ol",
-    "ul",
-    "menu",
-    "li",
-    "dl",
-    "dt",
-    "dd",
-    "figure",
-    "figcaption",
-    "main",
-    "div",
-    "table",
-    "form",
-    "fieldset",
-    "legend",
-    "details",
-    "summary",
-]
+# The tags that lay out as blocks. We only ever check whether a tag is in it,
+# so it's a frozenset, where that's a single hash lookup rather than a scan.
+BLOCK_ELEMENTS = frozenset(
+    [
+        "html",
+        "body",
+        "article",
+        "section",
+        "nav",
+        "aside",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "hgroup",
+        "header",
+        "footer",
+        "address",
+        "p",
+        "hr",
+        "pre",
+        "blockquote",
+        "ol",
+        "ul",
+        "menu",
+        "li",
+        "dl",
+        "dt",
+        "dd",
+        "figure",
+        "figcaption",
+        "main",
+        "div",
+        "table",
+        "form",
+        "fieldset",
+        "legend",
+        "details",
+        "summary",
+    ]
+)
+
+
+# The tags that change the font of the text inside them
+FONT_TAGS = frozenset(["i", "b", "small", "big"])
 
 
 def layout_mode(node):
     if isinstance(node, Text):
         return "inline"
+    # Layout, paint, and printing the layout tree all ask for an element's
+    # mode, and the answer never changes once the page is parsed, so only
+    # look through its children the first time
+    elif node.layout_mode is not None:
+        return node.layout_mode
     elif node.children:
+        # A generator, rather than a list, lets any stop at the first block
+        # child instead of checking every child first
         if any(
-            [
-                isinstance(child, Element) and child.tag in BLOCK_ELEMENTS
-                for child in node.children
-            ]
+            isinstance(child, Element) and child.tag in BLOCK_ELEMENTS
+            for child in node.children
         ):
-            return "block"
+            node.layout_mode = "block"
         else:
-            return "inline"
+            node.layout_mode = "inline"
     else:
-        return "block"
+        node.layout_mode = "block"
+    return node.layout_mode
 
 
 class BlockLayout:
+    # There's a layout object for every element on the page, and a drawing
+    # command for every word, so declare their attributes up front rather than
+    # giving each one a dictionary of them
+    __slots__ = (
+        "node",
+        "parent",
+        "previous",
+        "children",
+        "x",
+        "y",
+        "width",
+        "height",
+        "display_list",
+        "cursor_x",
+        "cursor_y",
+        "weight",
+        "style",
+        "size",
+        "line_height",
+        "line",
+        "font",
+        "space_width",
+    )
+
     def __init__(self, node, parent, previous):
         self.node = node
         self.parent = parent
@@ -82,7 +122,25 @@ class BlockLayout:
         self.width = None
         self.height = None
 
+    # Lay out this block and every block inside it. Each block works out its
+    # position before its children, but its height only after them, and each
+    # child goes below the one before it. Rather than recursing into each
+    # child, keep a stack of blocks to visit: a block goes on it twice, once to
+    # start laying it out, and once more, under its children, to finish.
     def layout(self):
+        stack = [(self, False)]
+        while stack:
+            block, finishing = stack.pop()
+            if finishing:
+                block.finish_layout()
+            else:
+                block.start_layout()
+                stack.append((block, True))
+                stack.extend((child, False) for child in reversed(block.children))
+
+    # Work out where this block goes, and either create its children, or lay
+    # out its text
+    def start_layout(self):
         self.width = self.parent.width
         self.x = self.parent.x
 
@@ -109,29 +167,46 @@ class BlockLayout:
             self.style = "roman"
             self.size = 16
             self.line_height = 0
+            # The font for the current size, weight, and style, along with the
+            # width of a space in it; see text
+            self.font = None
+            self.space_width = None
 
             self.line = []
             self.recurse(self.node)
             self.flush()
 
-        for child in self.children:
-            child.layout()
-
-        if mode == "block":
+    # Work out how tall this block is, once its children are laid out
+    def finish_layout(self):
+        if layout_mode(self.node) == "block":
             self.height = sum([child.height for child in self.children])
         else:
             self.height = self.cursor_y
 
+    # Walk the tree under node in order, opening each tag, laying out its
+    # text and children, and then closing it. Rather than recursing, which
+    # costs a Python call per node and can hit the recursion limit on deeply
+    # nested pages, keep our own stack of nodes to visit. A tag goes on it
+    # twice: once to open it, and once more, under its children, to close it.
     def recurse(self, node):
-        if isinstance(node, Text):
-            self.text(node)
-        else:
-            self.open_tag(node.tag)
-            for child in node.children:
-                self.recurse(child)
-            self.close_tag(node.tag)
+        text, open_tag, close_tag = self.text, self.open_tag, self.close_tag
+        stack = [(node, False)]
+        while stack:
+            node, closing = stack.pop()
+            if isinstance(node, Text):
+                text(node)
+            elif closing:
+                close_tag(node.tag)
+            else:
+                open_tag(node.tag)
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
 
     def open_tag(self, tag):
+        # These tags change the font, so text needs to look it up again
+        if tag in FONT_TAGS:
+            self.font = None
+
         if tag == "i":
             self.style = "italic"
         elif tag == "b":
@@ -147,6 +222,9 @@ class BlockLayout:
             self.width -= 2 * HSTEP
 
     def close_tag(self, tag):
+        if tag in FONT_TAGS:
+            self.font = None
+
         if tag == "i":
             self.style = "roman"
         elif tag == "b":
@@ -162,27 +240,35 @@ class BlockLayout:
             pass
 
     def text(self, node):
-        font = get_font(self.size, self.weight, self.style)
+        # Most text is in the same font as the text before it, so hold on to
+        # the font (and the width of a space in it) until a tag changes it.
+        # Measuring text asks Tk, which is slow, so go through chapter 3's
+        # caches of widths.
+        if self.font is None:
+            self.font = get_font(self.size, self.weight, self.style)
+            self.space_width = measure(self.font, " ")
+        font, space_width = self.font, self.space_width
         for word in node.text.split():
-            w = font.measure(word)
+            w = measure(font, word)
             if self.cursor_x + w > self.width:
                 self.flush()
             self.line.append((self.cursor_x, word, font))
-            self.cursor_x += w + font.measure(" ")
+            self.cursor_x += w + space_width
 
     def flush(self):
         if not self.line:
             return
-        metrics = [font.metrics() for x, word, font in self.line]
-        max_ascent = max([metric["ascent"] for metric in metrics])
+        # Font metrics never change, so these come from chapter 3's cache too
+        line_metrics = [metrics(font) for x, word, font in self.line]
+        max_ascent = max([metric["ascent"] for metric in line_metrics])
         baseline = self.cursor_y + 1.25 * max_ascent
-        for rel_x, word, font in self.line:
+        for (rel_x, word, font), metric in zip(self.line, line_metrics):
             x = self.x + rel_x
-            y = self.y + baseline - font.metrics("ascent")
+            y = self.y + baseline - metric["ascent"]
             self.display_list.append((x, y, word, font))
         self.cursor_x = 0
         self.line = []
-        max_descent = max([metric["descent"] for metric in metrics])
+        max_descent = max([metric["descent"] for metric in line_metrics])
         self.cursor_y = baseline + 1.25 * max_descent
         if not self.line_height:
             self.line_height = self.cursor_y
@@ -225,6 +311,8 @@ class BlockLayout:
 
 
 class DocumentLayout:
+    __slots__ = ("node", "parent", "previous", "children", "x", "y", "width", "height")
+
     def __init__(self, node):
         self.node = node
         self.parent = None
@@ -249,13 +337,15 @@ class DocumentLayout:
 
 
 class DrawText:
+    __slots__ = ("top", "left", "bottom", "text", "font")
+
     def __init__(self, x1, y1, text, font):
         self.top = y1
         self.left = x1
         self.text = text
         self.font = font
 
-        self.bottom = y1 + font.metrics("linespace")
+        self.bottom = y1 + metrics(font)["linespace"]
 
     def execute(self, scroll, canvas):
         canvas.create_text(
@@ -273,6 +363,8 @@ class DrawText:
 
 
 class DrawRect:
+    __slots__ = ("top", "left", "bottom", "right", "color")
+
     def __init__(self, x1, y1, x2, y2, color):
         self.top = y1
         self.left = x1
@@ -305,24 +397,57 @@ class Browser:
         self.scroll = 0
         self.window.bind("<Down>", self.scrolldown)
         self.display_list = []
+        # What the current display list was laid out from; see load
+        self.layout_key = None
 
     def load(self, url):
         headers, body = request(url)
+        # Reloading a page very often gets back exactly the same page (our
+        # cache in chapter 1 sees to that), and then parsing it and laying it
+        # out again would get exactly the same display list. So if neither the
+        # page nor anything layout depends on has changed, just redraw.
+        layout_key = (body, WIDTH, HSTEP, VSTEP)
+        if layout_key == self.layout_key:
+            self.draw()
+            return
+        self.layout_key = layout_key
+
         self.nodes = HTMLParser(body).parse()
         self.document = DocumentLayout(self.nodes)
         self.document.layout()
         self.display_list = []
         self.document.paint(self.display_list)
+        # draw checks the top and bottom of every command each time it runs,
+        # so pull them out into lists of their own once, rather than looking
+        # them up on each command every time we scroll
+        self.tops = [cmd.top for cmd in self.display_list]
+        self.bottoms = [cmd.bottom for cmd in self.display_list]
+        # Commands come out of paint roughly in order down the page, but not
+        # exactly (a list item's bullet comes after its text, say), and we
+        # have to draw them in that order, so we can't sort them. Instead, as
+        # chapter 3 does, keep the furthest-down bottom of the commands so far
+        # and the furthest-up top of the commands from here on. Those are both
+        # sorted, so draw can binary search them.
+        self.max_bottoms = list(itertools.accumulate(self.bottoms, max))
+        self.min_tops = list(itertools.accumulate(reversed(self.tops), min))[::-1]
         self.draw()
 
     def draw(self):
-        self.canvas.delete("all")
-        for cmd in self.display_list:
-            if cmd.top > self.scroll + HEIGHT:
+        canvas = self.canvas
+        canvas.delete("all")
+        top, bottom = self.scroll, self.scroll + HEIGHT
+        # Every command before start is above the window, and every command
+        # from end on is below it, so only check the ones in between
+        start = bisect.bisect_left(self.max_bottoms, top)
+        end = bisect.bisect_right(self.min_tops, bottom)
+        for cmd_top, cmd_bottom, cmd in zip(
+            self.tops[start:end], self.bottoms[start:end], self.display_list[start:end]
+        ):
+            if cmd_top > bottom:
                 continue
-            if cmd.bottom < self.scroll:
+            if cmd_bottom < top:
                 continue
-            cmd.execute(self.scroll, self.canvas)
+            cmd.execute(top, canvas)
 
         if self.document.height > HEIGHT:
             self.draw_scrollbar()
@@ -340,7 +465,13 @@ class Browser:
 
     def scrolldown(self, e):
         max_y = self.document.height - HEIGHT
-        self.scroll = min(self.scroll + SCROLL_STEP, max_y)
+        scroll = min(self.scroll + SCROLL_STEP, max_y)
+        # Redrawing deletes and recreates everything on screen, one Tk call at
+        # a time, so skip it once we're at the bottom of the page and
+        # scrolling doesn't move anything
+        if scroll == self.scroll:
+            return
+        self.scroll = scroll
         self.draw()
 
 
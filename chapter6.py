@@ -8,7 +8,7 @@ import socket
 import ssl
 import tkinter
 import tkinter.font
-from chapter1 import request
+from chapter1 import request, request_many
 from chapter2 import WIDTH, HEIGHT, HSTEP, VSTEP, SCROLL_STEP
 from chapter3 import FONTS, get_font
 from chapter4 import Text, Element, print_tree, HTMLParser
@@ -454,11 +454,12 @@ class Browser:
             and "href" in node.attributes
             and node.attributes.get("rel") == "stylesheet"
         ]
-        for link in links:
-            try:
-                header, body = request(resolve_url(link, url))
-            except:
+        # Download all of the style sheets at once, skipping any that fail
+        responses = request_many([resolve_url(link, url) for link in links])
+        for response in responses:
+            if isinstance(response, Exception):
                 continue
+            header, body = response
             rules.extend(CSSParser(body).parse())
         style(self.nodes, sorted(rules, key=cascade_priority))
 